@@ -1,20 +1,30 @@
 import asyncio
-import json
 import logging
-import random
-import yaml
+import os
 import datetime
+import functools
 import hashlib
+import heapq
+import hmac
 import argparse
+import secrets
 import uuid
 import sys
 
-import nacl
-from nacl.public import PrivateKey
-from aiohttp import web, ClientSession
+import nacl.secret
+import orjson
+from aiohttp import web, ClientError, ClientSession, ClientTimeout, TCPConnector
 
 from nuki import Nuki, NukiManager, BridgeType, DeviceType
 
+try:
+    # libuv-backed event loop; a solid win for this BLE + HTTP workload on the
+    # Pi, but purely optional
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 LOG_FORMAT = "%(asctime)s.%(msecs)03d|%(levelname).1s|%(filename)s:%(lineno)d|%(message)s"
 
 logger = logging.getLogger("raspinukibridge")
@@ -28,19 +38,61 @@ logging.getLogger("bleak").addHandler(handler)
 logging.getLogger("bleak").setLevel(logging.ERROR)
 
 
+def _requires_token(handler):
+    # Shared auth guard: reads request.query once and hands the mapping to
+    # the handler, replacing the check duplicated at the top of every endpoint
+    @functools.wraps(handler)
+    async def wrapper(self, request):
+        query = request.query
+        if not self._check_token(query):
+            raise web.HTTPForbidden()
+        return await handler(self, query)
+    return wrapper
+
+
+def _json_response(obj):
+    # orjson serializes straight to bytes, skipping the str -> utf-8 re-encode
+    # that web.Response(text=...) would do
+    return web.Response(body=orjson.dumps(obj, default=str), content_type="application/json")
+
+
 class WebServer:
 
+    __slots__ = ("_host", "_port", "_token", "_token_bytes", "_token_suffix", "_hashed_token",
+                 "_hashed_token_box", "_used_token", "nuki_manager", "_start_datetime",
+                 "_server_id", "_http_callbacks", "_nuki_fragments", "_scan_results_cache",
+                 "_state_cache", "_callback_session", "_used_token_heap", "_info_static",
+                 "_callback_list_cache", "_state_body_cache")
+
     def __init__(self, host, port, token, server_id, nuki_manager):
         self._host = host
         self._port = port
         self._token = token
-        self._hashed_token = hashlib.sha256(str(self._token).encode('utf-8')).digest()
+        self._token_bytes = str(self._token).encode('utf-8')
+        self._token_suffix = b"," + self._token_bytes
+        self._hashed_token = hashlib.sha256(self._token_bytes).digest()
         self._hashed_token_box = nacl.secret.SecretBox(self._hashed_token)
         self._used_token = {}
+        self._used_token_heap = []
         self.nuki_manager = nuki_manager
         self._start_datetime = None
         self._server_id = server_id & 0xFFFFFFFF  # Truncate server_id to 32 bit, OpenHub doesn't like it too big
         self._http_callbacks = [None, None, None]  # Nuki Bridge support up to 3 callbacks
+        # Serialized payloads are pure functions of the nuki states, so they are
+        # cached between state changes instead of being rebuilt on every poll
+        self._nuki_fragments = {}
+        self._scan_results_cache = None
+        self._state_cache = {}
+        # The static half of the /info payload never changes after startup
+        self._info_static = {"bridgeType": BridgeType.SW.value,
+                             # The hardwareId and firmwareVersion should not be sent if bridgeType is BRIDGE_SW,
+                             # but the homeassistant integration expects it
+                             "ids": {"hardwareId": self._server_id, "serverId": self._server_id},
+                             "versions": {"appVersion": "0.1.0", "firmwareVersion": "0.1.0"},
+                             "serverConnected": False}
+        self._callback_session = None
+        self._callback_list_cache = None
+        self._state_body_cache = {}
 
     def start(self):
         app = web.Application()
@@ -54,158 +106,215 @@ class WebServer:
                         web.get('/callback/list', self.callback_list),
                         web.get('/callback/remove', self.callback_remove)])
         app.on_startup.append(self._startup)
+        app.on_cleanup.append(self._cleanup)
         web.run_app(app, host=self._host, port=self._port)
 
-    @staticmethod
-    def _get_nuki_last_state(nuki):
-        state = {"mode": nuki.last_state["nuki_state"].value,
-                 "state": nuki.last_state["lock_state"].value,
-                 "stateName": nuki.last_state["lock_state"].name,
-                 "batteryCritical": nuki.is_battery_critical,
-                 "batteryCharging": nuki.is_battery_charging,
-                 "batteryChargeState": nuki.battery_percentage,
-                 "keypadBatteryCritical": False,  # How to get this from bt api?
-                 "doorsensorState": nuki.last_state["door_sensor_state"].value,
-                 "doorsensorStateName": nuki.last_state["door_sensor_state"].name,
-                 "ringactionTimestamp": None,  # How to get this from bt api?
-                 "ringactionState": None,  # How to get this from bt api?
-                 "timestamp": nuki.last_state["current_time"].isoformat().split(".")[0],
-                 "success": True,
-                 }
-
-        if nuki.device_type == DeviceType.OPENER:
-            state["ringactionTimestamp"] = nuki.last_state["current_time"].isoformat().split(".")[0]
-            state["ringactionState"] = nuki.last_state["last_lock_action_completion_status"]
-
+    def _get_nuki_last_state(self, nuki):
+        state = self._state_cache.get(nuki.address)
+        if state is None:
+            ls = nuki.last_state
+            state = {"mode": ls["nuki_state"].value,
+                     "state": ls["lock_state"].value,
+                     "stateName": ls["lock_state"].name,
+                     "batteryCritical": nuki.is_battery_critical,
+                     "batteryCharging": nuki.is_battery_charging,
+                     "batteryChargeState": nuki.battery_percentage,
+                     "keypadBatteryCritical": False,  # How to get this from bt api?
+                     "doorsensorState": ls["door_sensor_state"].value,
+                     "doorsensorStateName": ls["door_sensor_state"].name,
+                     "ringactionTimestamp": None,  # How to get this from bt api?
+                     "ringactionState": None,  # How to get this from bt api?
+                     "timestamp": ls["current_time"].isoformat(timespec="seconds"),
+                     "success": True,
+                     }
+
+            if nuki.device_type == DeviceType.OPENER:
+                # Same instant as "timestamp" above, reuse the rendered string
+                state["ringactionTimestamp"] = state["timestamp"]
+                state["ringactionState"] = ls["last_lock_action_completion_status"]
+
+            self._state_cache[nuki.address] = state
         return state
 
     async def _newstate(self, nuki):
-        logger.info(f"Nuki new state: {nuki.last_state}")
-        if any(self._http_callbacks):
-            async with ClientSession() as session:
-                for url in filter(None, self._http_callbacks):
-                    try:
-                        data = {"nukiId": nuki.config["id"],
-                                "deviceType": nuki.device_type.value}  # How to get this from bt api?
-                        data.update(self._get_nuki_last_state(nuki))
-                        async with session.post(url, data=json.dumps(data)) as resp:
-                            await resp.text()
-                    except:
-                        logger.exception(f"Error on http callbak {url}")
+        self._nuki_fragments.pop(nuki.address, None)
+        self._scan_results_cache = None
+        self._state_cache.pop(nuki.address, None)
+        self._state_body_cache.pop(nuki.address, None)
+        if not any(self._http_callbacks):
+            # The callback stays installed so the caches above are always
+            # invalidated; with nobody listening, stop here before any
+            # logging or session work
+            return
+        logger.info("Nuki new state: %s", nuki.last_state)
+        if self._callback_session is None:
+            # Lazily created and kept for the process lifetime so the
+            # connection pool (and HTTP keep-alive) survives across events
+            self._callback_session = ClientSession(
+                timeout=ClientTimeout(total=10),
+                read_bufsize=2 ** 20,
+                connector=TCPConnector(limit_per_host=4, ttl_dns_cache=600,
+                                       enable_cleanup_closed=True))
+        data = {"nukiId": nuki.id,
+                "deviceType": nuki.device_type.value}  # How to get this from bt api?
+        data.update(self._get_nuki_last_state(nuki))
+        payload = orjson.dumps(data, default=str)
+        # The callbacks are independent, fan them out concurrently
+        await asyncio.gather(*(self._post_callback(url, payload)
+                               for url in filter(None, self._http_callbacks)))
+
+    async def _post_callback(self, url, payload):
+        try:
+            # The response body is never used, release the connection without
+            # reading it
+            resp = await self._callback_session.post(
+                url, data=payload, headers={"Content-Type": "application/json"})
+            resp.release()
+        except (ClientError, asyncio.TimeoutError):
+            logger.exception("Error on http callbak %s", url)
+
+    async def _cleanup(self, _app):
+        if self._callback_session is not None:
+            await self._callback_session.close()
 
     async def _startup(self, _app):
         self._start_datetime = datetime.datetime.now()
+        # Always installed so the response caches are invalidated on every state change
+        self.nuki_manager.newstate_callback = self._newstate
         await self.nuki_manager.start_scanning()
 
-    async def callback_add(self, request):
-        if not self._check_token(request):
-            raise web.HTTPForbidden()
-        callback_url = request.query["url"]
-        for i, call in enumerate(self._http_callbacks):
-            if not call:
-                self._http_callbacks[i] = callback_url
-                break
-        if not self.nuki_manager.newstate_callback:
-            self.nuki_manager.newstate_callback = self._newstate
-        logger.info(f"Add http callback: {callback_url}")
-        return web.Response(text=json.dumps({"success": True}))
-
-    async def callback_list(self, request):
-        if not self._check_token(request):
-            raise web.HTTPForbidden()
-        resp = {"callbacks": [{"id": url_id, "url": url} for url_id, url in enumerate(self._http_callbacks) if url]}
-        return web.Response(text=json.dumps(resp))
-
-    async def callback_remove(self, request):
-        if not self._check_token(request):
-            raise web.HTTPForbidden()
-        url_id = request.query["id"]
+    @_requires_token
+    async def callback_add(self, query):
+        callback_url = query["url"]
+        url_id = next((i for i, call in enumerate(self._http_callbacks) if not call), None)
+        if url_id is None:
+            return web.Response(body=orjson.dumps({"success": False, "error": "too many callbacks"}),
+                                content_type="application/json", status=400)
+        self._http_callbacks[url_id] = callback_url
+        self._callback_list_cache = None
+        self._state_body_cache = {}
+        logger.info("Add http callback: %s", callback_url)
+        return _json_response({"success": True, "id": url_id})
+
+    @_requires_token
+    async def callback_list(self, query):
+        body = self._callback_list_cache
+        if body is None:
+            # The callback set only changes through add/remove, serialize once
+            body = orjson.dumps({"callbacks": [{"id": url_id, "url": url}
+                                               for url_id, url in enumerate(self._http_callbacks) if url]})
+            self._callback_list_cache = body
+        return web.Response(body=body, content_type="application/json")
+
+    @_requires_token
+    async def callback_remove(self, query):
+        url_id = query["id"]
         self._http_callbacks[int(url_id)] = None
-        return web.Response(text=json.dumps({"success": True}))
-
-    async def nuki_list(self, request):
-        if not self._check_token(request):
-            raise web.HTTPForbidden()
-        resp = [{"nukiId": nuki.config["id"],
-                 "deviceType": nuki.device_type.value,  # How to get this from bt api?
-                 "name": nuki.config["name"],
-                 "lastKnownState": self._get_nuki_last_state(nuki)} for nuki in self.nuki_manager if nuki.config]
-        return web.Response(text=json.dumps(resp))
-
-    async def nuki_info(self, request):
-        if not self._check_token(request):
-            raise web.HTTPForbidden()
-        resp = {"bridgeType": BridgeType.SW.value,
-                # The hardwareId and firmwareVersion should not be sent if bridgeType is BRIDGE_SW,
-                # but the homeassistant integration expects it
-                "ids": {"hardwareId": self._server_id, "serverId": self._server_id},
-                "versions": {"appVersion": "0.1.0", "firmwareVersion": "0.1.0"},
-                "uptime": (datetime.datetime.now() - self._start_datetime).seconds,
-                "currentTime": datetime.datetime.now().isoformat()[:-7] + "Z",
-                "serverConnected": False,
-                "scanResults": [{"nukiId": nuki.config["id"],
-                                 "type": nuki.device_type.value,  # How to get this from bt api?
-                                 "name": nuki.config["name"],
-                                 "rssi": nuki.rssi,
-                                 "paired": True} for nuki in self.nuki_manager if nuki.config]}
-        return web.Response(text=json.dumps(resp))
+        self._callback_list_cache = None
+        self._state_body_cache = {}
+        return _json_response({"success": True})
+
+    @_requires_token
+    async def nuki_list(self, query):
+        body = b"[" + b",".join(self._nuki_fragment(nuki)
+                                for nuki in self.nuki_manager if nuki.config) + b"]"
+        return web.Response(body=body, content_type="application/json")
+
+    def _nuki_fragment(self, nuki):
+        fragment = self._nuki_fragments.get(nuki.address)
+        if fragment is None:
+            fragment = orjson.dumps({"nukiId": nuki.id,
+                                     "deviceType": nuki.device_type.value,  # How to get this from bt api?
+                                     "name": nuki.name,
+                                     "lastKnownState": self._get_nuki_last_state(nuki)}, default=str)
+            self._nuki_fragments[nuki.address] = fragment
+        return fragment
+
+    @_requires_token
+    async def nuki_info(self, query):
+        if self._scan_results_cache is None:
+            self._scan_results_cache = [{"nukiId": nuki.id,
+                                         "type": nuki.device_type.value,  # How to get this from bt api?
+                                         "name": nuki.name,
+                                         "rssi": nuki.rssi,
+                                         "paired": True} for nuki in self.nuki_manager if nuki.config]
+        now = datetime.datetime.now()
+        resp = {**self._info_static,
+                "uptime": int((now - self._start_datetime).total_seconds()),
+                "currentTime": now.isoformat(timespec="seconds") + "Z",
+                "scanResults": self._scan_results_cache}
+        return _json_response(resp)
 
     def _clear_old_ctokens(self):
-        for ctk in list(self._used_token.keys()):
-            diff = (datetime.datetime.utcnow() - self._used_token[ctk]).total_seconds()
-            if diff > 60:
-                del self._used_token[ctk]
-
-    def _check_token(self, request):
-        if "hash" in request.query:
-            rnr = request.query["rnr"]
-            ts = request.query["ts"]
-            hash_256 = hashlib.sha256(f"{ts},{rnr},{self._token}".encode("utf-8")).hexdigest()
-            return hash_256 == request.query["hash"]
-        elif "token" in request.query:
-            return self._token == request.query["token"]
-        elif "ctoken" in request.query:
-            nonce = bytes.fromhex(request.query["nonce"])
-            ctoken = bytes.fromhex(request.query["ctoken"])
+        # The heap keeps the tokens time-ordered, so expiry only touches the
+        # entries that are actually stale instead of scanning the whole dict
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=60)
+        heap = self._used_token_heap
+        while heap and heap[0][0] < cutoff:
+            _ts, ctk = heapq.heappop(heap)
+            self._used_token.pop(ctk, None)
+
+    def _check_token(self, query):
+        if "hash" in query:
+            rnr = query["rnr"]
+            ts = query["ts"]
+            # Feed the hasher piecewise to avoid building an f-string + bytes
+            # buffer per request; the token bytes are precomputed in __init__
+            h = hashlib.sha256()
+            h.update(ts.encode("utf-8"))
+            h.update(b",")
+            h.update(rnr.encode("utf-8"))
+            h.update(self._token_suffix)
+            return hmac.compare_digest(h.hexdigest(), query["hash"])
+        elif "token" in query:
+            # Constant-time compare; the plain token is the secret itself
+            return hmac.compare_digest(str(self._token), query["token"])
+        elif "ctoken" in query:
+            nonce = bytes.fromhex(query["nonce"])
+            ctoken = bytes.fromhex(query["ctoken"])
             self._clear_old_ctokens()
             if ctoken not in self._used_token:
                 ts, rnr = self._hashed_token_box.decrypt(ctoken, nonce).decode().split(",")
                 ts = datetime.datetime.fromisoformat(ts[:-1])
                 diff = (datetime.datetime.utcnow() - ts).total_seconds()
                 self._used_token[ctoken] = ts
+                heapq.heappush(self._used_token_heap, (ts, ctoken))
                 return diff <= 60
         return False
 
-    async def nuki_lockaction(self, request):
-        if not self._check_token(request):
-            raise web.HTTPForbidden()
-        action = int(request.query["action"])
-        n = self.nuki_manager.nuki_by_id(int(request.query["nukiId"]))
-        await n.lock_action(action)
-        res = json.dumps({"success": True, "batteryCritical": n.is_battery_critical})
-        return web.Response(text=res)
-
-    async def nuki_state(self, request):
-        if not self._check_token(request):
-            raise web.HTTPForbidden()
-        n = self.nuki_manager.nuki_by_id(int(request.query["nukiId"]))
-        return web.Response(text=json.dumps(self._get_nuki_last_state(n)))
+    def _nuki_from_query(self, q):
+        try:
+            return self.nuki_manager.nuki_by_id(int(q["nukiId"]))
+        except (KeyError, ValueError, StopIteration):
+            raise web.HTTPBadRequest()
 
-    async def nuki_lock(self, request):
-        if not self._check_token(request):
-            raise web.HTTPForbidden()
-        n = self.nuki_manager.nuki_by_id(int(request.query["nukiId"]))
+    @_requires_token
+    async def nuki_lockaction(self, query):
+        action = int(query["action"])
+        n = self._nuki_from_query(query)
+        await n.lock_action(action)
+        return _json_response({"success": True, "batteryCritical": n.is_battery_critical})
+
+    @_requires_token
+    async def nuki_state(self, query):
+        n = self._nuki_from_query(query)
+        body = self._state_body_cache.get(n.address)
+        if body is None:
+            body = orjson.dumps(self._get_nuki_last_state(n), default=str)
+            self._state_body_cache[n.address] = body
+        return web.Response(body=body, content_type="application/json")
+
+    @_requires_token
+    async def nuki_lock(self, query):
+        n = self._nuki_from_query(query)
         await n.lock()
-        res = json.dumps({"success": True, "batteryCritical": n.is_battery_critical})
-        return web.Response(text=res)
+        return _json_response({"success": True, "batteryCritical": n.is_battery_critical})
 
-    async def nuki_unlock(self, request):
-        if not self._check_token(request):
-            raise web.HTTPForbidden()
-        n = self.nuki_manager.nuki_by_id(int(request.query["nukiId"]))
+    @_requires_token
+    async def nuki_unlock(self, query):
+        n = self._nuki_from_query(query)
         await n.unlock()
-        res = json.dumps({"success": True, "batteryCritical": n.is_battery_critical})
-        return web.Response(text=res)
+        return _json_response({"success": True, "batteryCritical": n.is_battery_critical})
 
 
 def _add_devices_to_manager(data, nuki_manager):
@@ -246,8 +355,8 @@ if __name__ == "__main__":
         logging.getLogger("bleak").setLevel(level=logging.DEBUG)
 
     if args.generate_config:
-        app_id = random.getrandbits(32)
-        token = random.getrandbits(256).to_bytes(32, "little").hex()
+        app_id = secrets.randbits(32)
+        token = secrets.token_hex(32)
         server_id = uuid.getnode()
         print(f"server:\n"
               f"  host: 0.0.0.0\n"
@@ -258,14 +367,26 @@ if __name__ == "__main__":
               f"  id: {server_id}\n")
         exit(0)
 
+    # Deferred: libyaml takes a noticeable chunk of the cold start on a Pi and
+    # the --generate-config path above does not need it
+    import yaml
+
     config_file = args.config or "nuki.yaml"
     with open(config_file) as f:
-        data = yaml.load(f, Loader=yaml.FullLoader)
+        # The libyaml loader parses several times faster than the pure-Python
+        # FullLoader; fall back when PyYAML was built without libyaml
+        data = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
 
-    if "id" not in data["server"]:
+    # uuid.getnode() probes the network interfaces, only call it when the id is
+    # actually missing (or unusable) and then reuse the single reading
+    if not isinstance(data["server"].get("id"), int):
         data["server"]["id"] = uuid.getnode()
-        with open(config_file, "w") as f:
-            yaml.dump(data, f)
+        # Write to a temp file and rename so a power loss mid-write cannot
+        # corrupt the config; the C dumper also keeps the rewrite quick
+        tmp_file = config_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            yaml.dump(data, f, Dumper=getattr(yaml, "CSafeDumper", yaml.SafeDumper))
+        os.replace(tmp_file, config_file)
 
     name = data["server"]["name"]
     app_id = data["server"]["app_id"]
@@ -274,21 +395,24 @@ if __name__ == "__main__":
     nuki_manager = NukiManager(name, app_id, bt_adapter)
 
     if args.pair:
+        # Pairing is a one-shot operation, keep the import off the normal start
+        from nacl.public import PrivateKey
+
         address = args.pair
-        logger.info(f"Generatig keys for Nuki {address}")
+        logger.info("Generatig keys for Nuki %s", address)
         keypair = PrivateKey.generate()
         bridge_public_key = keypair.public_key.__bytes__()
         bridge_private_key = keypair.__bytes__()
-        logger.info(f"bridge_public_key: {bridge_public_key.hex()}")
-        logger.info(f"bridge_private_key: {bridge_private_key.hex()}")
+        logger.info("bridge_public_key: %s", bridge_public_key.hex())
+        logger.info("bridge_private_key: %s", bridge_private_key.hex())
         nuki = Nuki(address, None, None, bridge_public_key, bridge_private_key)
         nuki_manager.add_nuki(nuki)
 
         loop = asyncio.get_event_loop()
 
         def pairing_completed(paired_nuki):
-            logger.info(f"Pairing completed, nuki_public_key: {paired_nuki.nuki_public_key.hex()}")
-            logger.info(f"Pairing completed, auth_id: {paired_nuki.auth_id.hex()}")
+            logger.info("Pairing completed, nuki_public_key: %s", paired_nuki.nuki_public_key.hex())
+            logger.info("Pairing completed, auth_id: %s", paired_nuki.auth_id.hex())
             loop.stop()
         loop.create_task(nuki.pair(pairing_completed))
         loop.run_forever()
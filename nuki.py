@@ -1,5 +1,7 @@
 import asyncio
 import datetime
+import functools
+import os
 import hashlib
 import logging
 import struct
@@ -7,8 +9,7 @@ import hmac
 import enum
 import binascii
 
-import nacl.utils
-import nacl.secret
+from nacl.bindings import crypto_secretbox, crypto_secretbox_open
 from nacl.bindings.crypto_box import crypto_box_beforenm
 from bleak import BleakScanner, BleakClient
 
@@ -118,21 +119,69 @@ class NukiClientType(enum.Enum):
     KEYPAD = 0x03
 
 
+# Precompiled parsers for the hot notification path; module-level Structs skip
+# the per-call format string lookup and unpack_from avoids slicing the buffer
+_CMD_HDR_STRUCT = struct.Struct("<H")
+_ENCRYPTED_HDR_STRUCT = struct.Struct("<IH")
+_STATE_STRUCT = struct.Struct("<BBBHBBBBBHBBBBBBBH")
+_CONFIG_STRUCT = struct.Struct("<I32sffBBBBBHBBBBBhBBBBBBBBBBBBBB")
+_CONFIG_TZ_STRUCT = struct.Struct("<I32sffBBBBBHBBBBBhBBBBBBBBBBBBBBH")
+_OPENER_CONFIG_STRUCT = struct.Struct("<I32sffBBBBHBBBBBhBBBBBBBBBBBBBH")
+_AUTH_ID_STRUCT = struct.Struct("<32s4s16s32s")
+_STATUS_STRUCT = struct.Struct("<B")
+_ERROR_REPORT_STRUCT = struct.Struct("<bH")
+
+# Request payloads that never change, framed once at import time
+_CHALLENGE_PAYLOAD = NukiCommand.CHALLENGE.value.to_bytes(2, "little")
+_KEYTURNER_STATES_PAYLOAD = NukiCommand.KEYTURNER_STATES.value.to_bytes(2, "little")
+
+
+def _frame_command(cmd_code, payload=bytes()):
+    message = _CMD_HDR_STRUCT.pack(cmd_code) + payload
+    return message + _CMD_HDR_STRUCT.pack(binascii.crc_hqx(message, 0xffff))
+
+
+# Payload-less commands are fully constant, so their complete frames
+# (header + CRC) are built once here and served by a dict lookup
+_EMPTY_FRAMES = {cmd.value: _frame_command(cmd.value) for cmd in NukiCommand}
+
 logger = logging.getLogger("raspinukibridge")
 
 
+@functools.lru_cache(maxsize=32)
+def _derive_shared_key(nuki_public_key, bridge_private_key):
+    # X25519 scalar multiplication is the most expensive crypto operation here,
+    # memoize it so re-creating the SecretBox for the same key pair is free
+    return crypto_box_beforenm(nuki_public_key, bridge_private_key)
+
+
 class NukiManager:
 
+    __slots__ = ("name", "app_id", "type_id", "app_id_bytes", "type_id_bytes",
+                 "name_bytes", "_newstate_callback", "_adapter", "_devices",
+                 "_devices_by_id", "_device_cache", "_scanner", "_adv_buf",
+                 "_drain_task")
+
     def __init__(self, name, app_id, adapter="hci0"):
         self.name = name
         self.app_id = app_id
         self.type_id = NukiClientType.BRIDGE
+        self.app_id_bytes = app_id.to_bytes(4, "little")
+        self.type_id_bytes = self.type_id.value.to_bytes(1, "little")
+        self.name_bytes = name.encode("utf-8").ljust(32, b"\0")
         self._newstate_callback = None
 
         self._adapter = adapter
         self._devices = {}
-        self._scanner = BleakScanner(adapter=self._adapter)
-        self._scanner.register_detection_callback(self._detected_ibeacon)
+        self._devices_by_id = {}
+        self._device_cache = ()
+        self._adv_buf = {}
+        self._drain_task = None
+        # No service_uuids filter here: a paired Nuki advertises plain
+        # iBeacon frames with no service UUIDs, so BlueZ would drop exactly
+        # the advertisements _detected_ibeacon is after
+        self._scanner = BleakScanner(adapter=self._adapter,
+                                     detection_callback=self._detected_ibeacon)
 
     @property
     def newstate_callback(self):
@@ -142,7 +191,7 @@ class NukiManager:
     def newstate_callback(self, value):
         self._newstate_callback = value
         for device in self._devices.values():
-            asyncio.get_event_loop().create_task(self.newstate_callback(device))
+            asyncio.create_task(self.newstate_callback(device))
 
     async def nuki_newstate(self, nuki):
         if self.newstate_callback:
@@ -152,21 +201,30 @@ class NukiManager:
         return BleakClient(address, adapter=self._adapter, timeout=timeout)
 
     def __getitem__(self, index):
-        return list(self._devices.values())[index]
+        return self._device_cache[index]
 
     def nuki_by_id(self, nuki_id):
-        return next(nuki for nuki in self._devices.values() if nuki.config.get("id") == nuki_id)
+        nuki = self._devices_by_id.get(nuki_id)
+        if nuki is None:
+            # The id is only known once the config has been read, so fill the
+            # lookup table lazily on first access
+            nuki = next(nuki for nuki in self._devices.values() if nuki.config.get("id") == nuki_id)
+            self._devices_by_id[nuki_id] = nuki
+        return nuki
 
     def add_nuki(self, nuki: 'Nuki'):
         nuki.manager = self
         self._devices[nuki.address] = nuki
+        self._device_cache = tuple(self._devices.values())
 
     @property
     def device_list(self):
-        return list(self._devices.values())
+        return self._device_cache
 
     async def start_scanning(self):
         logger.info("Start scanning")
+        if self._drain_task is None:
+            self._drain_task = asyncio.create_task(self._drain_advertisements())
         await self._scanner.start()
 
     async def stop_scanning(self):
@@ -177,31 +235,64 @@ class NukiManager:
             pass
 
     async def _detected_ibeacon(self, device, advertisement_data):
-        device_address = device.address.lower()
-        if device_address in self._devices:
-            manufacturer_data = advertisement_data.manufacturer_data[76]
-            if manufacturer_data[0] != 0x02:
-                # Ignore HomeKit advertisement
-                return
-            logger.info(f"Nuki: {device_address}, RSSI: {device.rssi} {advertisement_data}")
-            tx_p = manufacturer_data[-1]
-            nuki = self._devices[device_address]
-            nuki.set_ble_device(device)
-            nuki.rssi = device.rssi
-            if not nuki.device_type:
+        # This fires for every advertisement the adapter sees, keep the
+        # non-Nuki path down to a single dict lookup and no log formatting
+        nuki = self._devices.get(device.address.lower())
+        if nuki is None:
+            return
+        manufacturer_data = advertisement_data.manufacturer_data.get(76)
+        if not manufacturer_data or manufacturer_data[0] != 0x02:
+            # Ignore HomeKit advertisement
+            return
+        # Only buffer the advertisement; a busy channel delivers many per
+        # second and the drain loop only acts on the latest one per device
+        self._adv_buf[nuki.address] = (nuki, device, advertisement_data)
+
+    async def _drain_advertisements(self):
+        while True:
+            await asyncio.sleep(0.05)
+            if not self._adv_buf:
+                continue
+            buffered = self._adv_buf
+            self._adv_buf = {}
+            for nuki, device, advertisement_data in buffered.values():
                 try:
-                    await nuki.connect()  # this will force the identification of the device type
-                except:
-                    await self.start_scanning()
-                    return
-            if not nuki.last_state or tx_p & 0x1:
-                await nuki.update_state()
-            elif not nuki.config:
-                await nuki.get_config()
+                    await self._process_advertisement(nuki, device, advertisement_data)
+                except Exception:
+                    # A failure for one device (connect timeout, not yet
+                    # paired, ...) must not kill the drain loop for all
+                    logger.exception("Error processing advertisement from %s", nuki.address)
+
+    async def _process_advertisement(self, nuki, device, advertisement_data):
+        manufacturer_data = advertisement_data.manufacturer_data[76]
+        logger.debug("Nuki: %s, RSSI: %s %s", nuki.address, device.rssi, advertisement_data)
+        tx_p = manufacturer_data[-1]
+        nuki.set_ble_device(device)
+        nuki.rssi = device.rssi
+        if not nuki.device_type:
+            try:
+                await nuki.connect()  # this will force the identification of the device type
+            except:
+                await self.start_scanning()
+                return
+        if not nuki.last_state or tx_p & 0x1:
+            await nuki.update_state()
+        elif not nuki.config:
+            await nuki.get_config()
 
 
 class Nuki:
 
+    __slots__ = ("address", "auth_id", "nuki_public_key", "bridge_public_key",
+                 "bridge_private_key", "manager", "id", "name", "rssi", "last_state",
+                 "config", "_device_type", "_pairing_handle", "_client",
+                 "_challenge_command", "_pairing_callback", "_command_timeout_task",
+                 "_reset_opener_state_task", "_notify_started", "_send_lock",
+                 "retry", "connection_timeout", "command_timeout",
+                 "_BLE_CHAR", "_BLE_PAIRING_CHAR", "_shared_key", "_hmac_template",
+                 "_batt_critical", "_batt_charging", "_batt_percentage",
+                 "_nonce_prefix", "_nonce_ctr")
+
     def __init__(self, address, auth_id, nuki_public_key, bridge_public_key, bridge_private_key):
         self.address = address
         self.auth_id = auth_id
@@ -214,6 +305,9 @@ class Nuki:
         self.rssi = None
         self.last_state = None
         self.config = {}
+        self._batt_critical = False
+        self._batt_charging = False
+        self._batt_percentage = None
 
         self._device_type = None
         self._pairing_handle = None
@@ -222,6 +316,8 @@ class Nuki:
         self._pairing_callback = None
         self._command_timeout_task = None
         self._reset_opener_state_task = None
+        self._notify_started = False
+        self._send_lock = asyncio.Lock()
         self.retry = 3
         self.connection_timeout = 10
         self.command_timeout = 30
@@ -245,193 +341,181 @@ class Nuki:
             self._BLE_PAIRING_CHAR = BLE_SMARTLOCK_PAIRING_CHAR
             self._BLE_CHAR = BLE_SMARTLOCK_CHAR
         self._device_type = device_type
-        logger.info(f"Device type: {self.device_type}")
+        logger.info("Device type: %s", self.device_type)
 
     def _create_shared_key(self):
-        self._shared_key = crypto_box_beforenm(self.nuki_public_key, self.bridge_private_key)
-        self._box = nacl.secret.SecretBox(self._shared_key)
+        self._shared_key = _derive_shared_key(self.nuki_public_key, self.bridge_private_key)
+        # Template with the key schedule (ipad/opad) already absorbed; copies
+        # skip those SHA-256 blocks on every authenticator computation
+        self._hmac_template = hmac.new(self._shared_key, digestmod=hashlib.sha256)
+        # Secretbox nonces only have to be unique under a key; a random
+        # per-session prefix plus a counter gives that without a getrandom()
+        # syscall on every command
+        self._nonce_prefix = os.urandom(16)
+        self._nonce_ctr = 0
 
     @property
     def is_battery_critical(self):
-        return bool(self.last_state["critical_battery_state"] & 1)
+        return self._batt_critical
 
     @property
     def is_battery_charging(self):
-        return bool(self.last_state["critical_battery_state"] & 2)
+        return self._batt_charging
 
     @property
     def battery_percentage(self):
-        return ((self.last_state["critical_battery_state"] & 252) >> 2) * 2
+        return self._batt_percentage
 
     @staticmethod
     def _prepare_command(cmd_code: int, payload=bytes()):
-        message = cmd_code.to_bytes(2, "little") + payload
-        crc = binascii.crc_hqx(message, 0xffff).to_bytes(2, "little")
-        message += crc
-        return message
+        if not payload:
+            return _EMPTY_FRAMES[cmd_code]
+        return _frame_command(cmd_code, payload)
 
     def _encrypt_command(self, cmd_code: int, payload=bytes()):
-        unencrypted = self.auth_id + self._prepare_command(cmd_code, payload)[:-2]
-        crc = binascii.crc_hqx(unencrypted, 0xffff).to_bytes(2, "little")
-        unencrypted += crc
-        nonce = nacl.utils.random(24)
-        encrypted = self._box.encrypt(unencrypted, nonce)[24:]
+        unencrypted = b"".join((self.auth_id, _CMD_HDR_STRUCT.pack(cmd_code), payload))
+        crc = _CMD_HDR_STRUCT.pack(binascii.crc_hqx(unencrypted, 0xffff))
+        self._nonce_ctr += 1
+        nonce = self._nonce_prefix + self._nonce_ctr.to_bytes(8, "little")
+        # crypto_secretbox returns the bare ciphertext, avoiding the
+        # EncryptedMessage (nonce + ciphertext) object SecretBox.encrypt builds
+        # only for us to slice the nonce off again
+        encrypted = crypto_secretbox(unencrypted + crc, nonce, self._shared_key)
         length = len(encrypted).to_bytes(2, "little")
-        message = nonce + self.auth_id + length + encrypted
-        return message
+        return b"".join((nonce, self.auth_id, length, encrypted))
 
     def _decrypt_command(self, data):
-        nonce = data[:24]
-        auth_id, length = struct.unpack("<IH", data[24:30])
-        encrypted = nonce + data[30:30 + length]
-        decrypted = self._box.decrypt(encrypted)
+        auth_id, length = _ENCRYPTED_HDR_STRUCT.unpack_from(data, 24)
+        # The binding takes the nonce separately, so the nonce + ciphertext
+        # concatenation SecretBox.decrypt expects is never built
+        decrypted = crypto_secretbox_open(data[30:30 + length], data[:24], self._shared_key)
         return decrypted[4:]
 
+    def _parse_challenge(self, data):
+        return {"nonce": data}
+
+    def _parse_keyturner_states(self, data):
+        values = _STATE_STRUCT.unpack_from(data)
+        if self.device_type == DeviceType.OPENER:
+            lock_state = OpenerState(values[1])
+            timer_field = "ring_to_open_timer"
+        else:
+            lock_state = LockState(values[1])
+            timer_field = "lock_n_go_timer"
+        return {"nuki_state": NukiState(values[0]),
+                "lock_state": lock_state,
+                "trigger": values[2],
+                "current_time": datetime.datetime(values[3], values[4], values[5],
+                                                  values[6], values[7], values[8]),
+                "timezone_offset": values[9],
+                "critical_battery_state": values[10],
+                "current_update_count": values[11],
+                timer_field: values[12],
+                "last_lock_action": NukiAction(values[13]),
+                "last_lock_action_trigger": values[14],
+                "last_lock_action_completion_status": values[15],
+                "door_sensor_state": DoorsensorState(values[16]),
+                "nightmode_active": values[17],
+                # "accessory_battery_state": values[18],  # It doesn't exist?
+                }
+
+    def _parse_config(self, data):
+        if self.device_type == DeviceType.OPENER:
+            values = _OPENER_CONFIG_STRUCT.unpack_from(data)
+            return {"id": values[0],
+                    "name": values[1].split(b"\x00")[0].decode(),
+                    "latitude": values[2],
+                    "longitude": values[3],
+                    "auto_unlatch": values[4],
+                    "pairing_enabled": values[5],
+                    "button_enabled": values[6],
+                    "led_enabled": values[7],
+                    "current_time": datetime.datetime(values[8], values[9], values[10],
+                                                      values[11], values[12], values[13]),
+                    "timezone_offset": values[14],
+                    "dst_mode": values[15],
+                    "has_fob": values[16],
+                    "fob_action_1": values[17],
+                    "fob_action_2": values[18],
+                    "fob_action_3": values[19],
+                    "operating_mode": values[20],
+                    "advertising_mode": values[21],
+                    "has_keypad": values[22],
+                    "firmware_version": f"{values[23]}.{values[24]}.{values[25]}",
+                    "hardware_revision": f"{values[26]}.{values[27]}",
+                    "timezone_id": values[28],
+                    }
+        if len(data) == 72:
+            values = _CONFIG_STRUCT.unpack_from(data)
+        else:
+            values = _CONFIG_TZ_STRUCT.unpack_from(data)
+        config = {"id": values[0],
+                  "name": values[1].split(b"\x00")[0].decode(),
+                  "latitude": values[2],
+                  "longitude": values[3],
+                  "auto_unlatch": values[4],
+                  "pairing_enabled": values[5],
+                  "button_enabled": values[6],
+                  "led_enabled": values[7],
+                  "led_brightness": values[8],
+                  "current_time": datetime.datetime(values[9], values[10], values[11],
+                                                    values[12], values[13], values[14]),
+                  "timezone_offset": values[15],
+                  "dst_mode": values[16],
+                  "has_fob": values[17],
+                  "fob_action_1": values[18],
+                  "fob_action_2": values[19],
+                  "fob_action_3": values[20],
+                  "single_lock": values[21],
+                  "advertising_mode": values[22],
+                  "has_keypad": values[23],
+                  "firmware_version": f"{values[24]}.{values[25]}.{values[26]}",
+                  "hardware_revision": f"{values[27]}.{values[28]}",
+                  "homekit_status": values[29],
+                  }
+        if len(values) > 30:
+            config["timezone_id"] = values[30]
+        return config
+
+    def _parse_public_key(self, data):
+        return {"public_key": data}
+
+    def _parse_auth_id(self, data):
+        values = _AUTH_ID_STRUCT.unpack_from(data)
+        return {"authenticator": values[0],
+                "auth_id": values[1],
+                "uuuid": values[2],
+                "nonce": values[3]}
+
+    def _parse_status(self, data):
+        status, = _STATUS_STRUCT.unpack_from(data)
+        return {"status": StatusCode(status)}
+
+    def _parse_error_report(self, data):
+        error, _cmd = _ERROR_REPORT_STRUCT.unpack_from(data)
+        return error
+
+    # Command-code dispatch table; a dict lookup replaces the long elif chain
+    # that used to re-test the command on every notification
+    _PARSERS = {NukiCommand.CHALLENGE: _parse_challenge,
+                NukiCommand.KEYTURNER_STATES: _parse_keyturner_states,
+                NukiCommand.CONFIG: _parse_config,
+                NukiCommand.PUBLIC_KEY: _parse_public_key,
+                NukiCommand.AUTH_ID: _parse_auth_id,
+                NukiCommand.STATUS: _parse_status,
+                NukiCommand.ERROR_REPORT: _parse_error_report,
+                }
+
     async def _parse_command(self, data):
-        command, = struct.unpack("<H", data[:2])
+        command, = _CMD_HDR_STRUCT.unpack_from(data)
         command = NukiCommand(command)
         #crc = data[-2:]
         data = data[2:-2]
-        logger.debug(f"Parsing command: {command}, data: {data}")
-
-        if command == NukiCommand.CHALLENGE:
-            return command, {"nonce": data}
-
-        elif self.device_type != DeviceType.OPENER and command == NukiCommand.KEYTURNER_STATES:
-            values = struct.unpack("<BBBHBBBBBHBBBBBBBH", data[:21])
-            return command, {"nuki_state": NukiState(values[0]),
-                             "lock_state": LockState(values[1]),
-                             "trigger": values[2],
-                             "current_time": datetime.datetime(values[3], values[4], values[5],
-                                                               values[6], values[7], values[8]),
-                             "timezone_offset": values[9],
-                             "critical_battery_state": values[10],
-                             "current_update_count": values[11],
-                             "lock_n_go_timer": values[12],
-                             "last_lock_action": NukiAction(values[13]),
-                             "last_lock_action_trigger": values[14],
-                             "last_lock_action_completion_status": values[15],
-                             "door_sensor_state": DoorsensorState(values[16]),
-                             "nightmode_active": values[17],
-                             # "accessory_battery_state": values[18],  # It doesn't exist?
-                             }
-        elif self.device_type == DeviceType.OPENER and command == NukiCommand.KEYTURNER_STATES:
-            values = struct.unpack("<BBBHBBBBBHBBBBBBBH", data[:21])
-            return command, {"nuki_state": NukiState(values[0]),
-                             "lock_state": OpenerState(values[1]),
-                             "trigger": values[2],
-                             "current_time": datetime.datetime(values[3], values[4], values[5],
-                                                               values[6], values[7], values[8]),
-                             "timezone_offset": values[9],
-                             "critical_battery_state": values[10],
-                             "current_update_count": values[11],
-                             "ring_to_open_timer": values[12],
-                             "last_lock_action": NukiAction(values[13]),
-                             "last_lock_action_trigger": values[14],
-                             "last_lock_action_completion_status": values[15],
-                             "door_sensor_state": DoorsensorState(values[16]),
-                             "nightmode_active": values[17],
-                             # "accessory_battery_state": values[18],  # It doesn't exist?
-                             }
-        elif self.device_type != DeviceType.OPENER and command == NukiCommand.CONFIG and len(data) == 72:
-            values = struct.unpack("<I32sffBBBBBHBBBBBhBBBBBBBBBBBBBB", data)
-            return command, {"id": values[0],
-                             "name": values[1].split(b"\x00")[0].decode(),
-                             "latitude": values[2],
-                             "longitude": values[3],
-                             "auto_unlatch": values[4],
-                             "pairing_enabled": values[5],
-                             "button_enabled": values[6],
-                             "led_enabled": values[7],
-                             "led_brightness": values[8],
-                             "current_time": datetime.datetime(values[9], values[10], values[11],
-                                                               values[12], values[13], values[14]),
-                             "timezone_offset": values[15],
-                             "dst_mode": values[16],
-                             "has_fob": values[17],
-                             "fob_action_1": values[18],
-                             "fob_action_2": values[19],
-                             "fob_action_3": values[20],
-                             "single_lock": values[21],
-                             "advertising_mode": values[22],
-                             "has_keypad": values[23],
-                             "firmware_version": f"{values[24]}.{values[25]}.{values[26]}",
-                             "hardware_revision": f"{values[27]}.{values[28]}",
-                             "homekit_status": values[29],
-                             }
-        elif self.device_type != DeviceType.OPENER and command == NukiCommand.CONFIG:
-            values = struct.unpack("<I32sffBBBBBHBBBBBhBBBBBBBBBBBBBBH", data[:74])
-            return command, {"id": values[0],
-                             "name": values[1].split(b"\x00")[0].decode(),
-                             "latitude": values[2],
-                             "longitude": values[3],
-                             "auto_unlatch": values[4],
-                             "pairing_enabled": values[5],
-                             "button_enabled": values[6],
-                             "led_enabled": values[7],
-                             "led_brightness": values[8],
-                             "current_time": datetime.datetime(values[9], values[10], values[11],
-                                                               values[12], values[13], values[14]),
-                             "timezone_offset": values[15],
-                             "dst_mode": values[16],
-                             "has_fob": values[17],
-                             "fob_action_1": values[18],
-                             "fob_action_2": values[19],
-                             "fob_action_3": values[20],
-                             "single_lock": values[21],
-                             "advertising_mode": values[22],
-                             "has_keypad": values[23],
-                             "firmware_version": f"{values[24]}.{values[25]}.{values[26]}",
-                             "hardware_revision": f"{values[27]}.{values[28]}",
-                             "homekit_status": values[29],
-                             "timezone_id": values[30],
-                             }
-
-        elif self.device_type == DeviceType.OPENER and command == NukiCommand.CONFIG:
-            values = struct.unpack("<I32sffBBBBHBBBBBhBBBBBBBBBBBBBH", data[:72])
-            return command, {"id": values[0],
-                             "name": values[1].split(b"\x00")[0].decode(),
-                             "latitude": values[2],
-                             "longitude": values[3],
-                             "auto_unlatch": values[4],
-                             "pairing_enabled": values[5],
-                             "button_enabled": values[6],
-                             "led_enabled": values[7],
-                             "current_time": datetime.datetime(values[8], values[9], values[10],
-                                                               values[11], values[12], values[13]),
-                             "timezone_offset": values[14],
-                             "dst_mode": values[15],
-                             "has_fob": values[16],
-                             "fob_action_1": values[17],
-                             "fob_action_2": values[18],
-                             "fob_action_3": values[19],
-                             "operating_mode": values[20],
-                             "advertising_mode": values[21],
-                             "has_keypad": values[22],
-                             "firmware_version": f"{values[23]}.{values[24]}.{values[25]}",
-                             "hardware_revision": f"{values[26]}.{values[27]}",
-                             "timezone_id": values[28],
-                             }
-
-        elif command == NukiCommand.PUBLIC_KEY:
-            return command, {"public_key": data}
-
-        elif command == NukiCommand.AUTH_ID:
-            values = struct.unpack("<32s4s16s32s", data[:84])
-            return command, {"authenticator": values[0],
-                             "auth_id": values[1],
-                             "uuuid": values[2],
-                             "nonce": values[3]}
-
-        elif command == NukiCommand.STATUS:
-            status, = struct.unpack('<B', data[:1])
-            return command, {"status": StatusCode(status)}
-
-        elif command == NukiCommand.ERROR_REPORT:
-            data, _cmd = struct.unpack('<bH', data[:3])
-            return command, data
-
-        return None, None
+        logger.debug("Parsing command: %s, data: %s", command, data)
+        parser = self._PARSERS.get(command)
+        if parser is None:
+            return None, None
+        return command, parser(self, data)
 
     async def reset_opener_state(self):
         await asyncio.sleep(30)
@@ -440,11 +524,16 @@ class Nuki:
             await self.manager.nuki_newstate(self)
 
     def set_ble_device(self, ble_device):
+        if self._client and self._client.is_connected:
+            # Keep the live client (and its GATT subscriptions) instead of
+            # replacing it on every advertisement
+            return self._client
         self._client = BleakClient(ble_device)
+        self._notify_started = False
         return self._client
 
     async def _notification_handler(self, sender, data):
-        logger.debug(f"Notification handler: {sender}, data: {data}")
+        logger.debug("Notification handler: %s, data: %s", sender, data)
         if sender == self._client.services[self._BLE_PAIRING_CHAR].handle:
             # The pairing handler is not encrypted
             command, data = await self._parse_command(bytes(data))
@@ -453,18 +542,21 @@ class Nuki:
             command, data = await self._parse_command(uncrypted)
 
         if command == NukiCommand.ERROR_REPORT:
-            logger.error(f"Error {data}")
+            logger.error("Error %s", data)
             await self.disconnect()
 
         if command == NukiCommand.KEYTURNER_STATES:
             update_config = not self.config or (self.last_state["current_update_count"] != data["current_update_count"])
             self.last_state = data
-            logger.info(f"State: {self.last_state}")
-            if self._challenge_command == NukiCommand.KEYTURNER_STATES:
-                if update_config:
-                    await self.get_config()
-                else:
-                    await self.disconnect()
+            # Decode the battery bitfield once per state update instead of on
+            # every property read while rendering responses
+            battery_state = data["critical_battery_state"]
+            self._batt_critical = bool(battery_state & 1)
+            self._batt_charging = bool(battery_state & 2)
+            self._batt_percentage = ((battery_state & 252) >> 2) * 2
+            logger.info("State: %s", self.last_state)
+            if self._challenge_command == NukiCommand.KEYTURNER_STATES and update_config:
+                await self.get_config()
             if self.config and self.last_state:
                 await self.manager.nuki_newstate(self)
             if self.device_type == DeviceType.OPENER and self.last_state["last_lock_action_completion_status"]:
@@ -472,30 +564,35 @@ class Nuki:
 
         elif command == NukiCommand.CONFIG:
             self.config = data
-            logger.info(f"Config: {self.config}")
-            await self.disconnect()
+            # Mirror the identity fields as plain attributes; the web layer
+            # reads them per request and skips the dict lookups
+            self.id = data["id"]
+            self.name = data["name"]
+            logger.info("Config: %s", self.config)
             if self.config and self.last_state:
                 await self.manager.nuki_newstate(self)
 
         elif command == NukiCommand.PUBLIC_KEY:
             self.nuki_public_key = data["public_key"]
             self._create_shared_key()
-            logger.info(f"Nuki {self.address} public key: {self.nuki_public_key.hex()}")
+            logger.info("Nuki %s public key: %s", self.address, self.nuki_public_key.hex())
             self._challenge_command = NukiCommand.PUBLIC_KEY
             cmd = self._prepare_command(NukiCommand.PUBLIC_KEY.value, self.bridge_public_key)
             await self._send_data(self._BLE_PAIRING_CHAR, cmd)
 
         elif command == NukiCommand.AUTH_ID:
             self.auth_id = data["auth_id"]
-            value_r = self.auth_id + data["nonce"]
-            payload = hmac.new(self._shared_key, msg=value_r, digestmod=hashlib.sha256).digest()
+            h = self._hmac_template.copy()
+            h.update(self.auth_id)
+            h.update(data["nonce"])
+            payload = h.digest()
             payload += self.auth_id
             self._challenge_command = NukiCommand.AUTH_ID_CONFIRM
             cmd = self._prepare_command(NukiCommand.AUTH_ID_CONFIRM.value, payload)
             await self._send_data(self._BLE_PAIRING_CHAR, cmd)
 
         elif command == NukiCommand.STATUS:
-            logger.error(f"Last action: {data}")
+            logger.error("Last action: %s", data)
             if self._challenge_command == NukiCommand.AUTH_ID_CONFIRM:
                 if self._pairing_callback:
                     self._pairing_callback(self)
@@ -504,55 +601,68 @@ class Nuki:
                 await self.disconnect()
 
         elif command == NukiCommand.CHALLENGE and self._challenge_command:
-            logger.debug(f"Challenge for {self._challenge_command}")
+            logger.debug("Challenge for %s", self._challenge_command)
             if self._challenge_command == NukiCommand.REQUEST_CONFIG:
                 cmd = self._encrypt_command(NukiCommand.REQUEST_CONFIG.value, data["nonce"])
                 await self._send_data(self._BLE_CHAR, cmd)
 
             elif self._challenge_command in NukiAction:
                 lock_action = self._challenge_command.value.to_bytes(1, "little")
-                app_id = self.manager.app_id.to_bytes(4, "little")
+                app_id = self.manager.app_id_bytes
                 flags = 0
                 payload = lock_action + app_id + flags.to_bytes(1, "little") + data["nonce"]
                 cmd = self._encrypt_command(NukiCommand.LOCK_ACTION.value, payload)
                 await self._send_data(self._BLE_CHAR, cmd)
 
             elif self._challenge_command == NukiCommand.PUBLIC_KEY:
-                value_r = self.bridge_public_key + self.nuki_public_key + data["nonce"]
-                payload = hmac.new(self._shared_key, msg=value_r, digestmod=hashlib.sha256).digest()
+                h = self._hmac_template.copy()
+                h.update(self.bridge_public_key)
+                h.update(self.nuki_public_key)
+                h.update(data["nonce"])
+                payload = h.digest()
                 self._challenge_command = NukiCommand.AUTH_AUTHENTICATOR
                 cmd = self._prepare_command(NukiCommand.AUTH_AUTHENTICATOR.value, payload)
                 await self._send_data(self._BLE_PAIRING_CHAR, cmd)
 
             elif self._challenge_command == NukiCommand.AUTH_AUTHENTICATOR:
-                app_id = self.manager.app_id.to_bytes(4, "little")
-                type_id = self.manager.type_id.value.to_bytes(1, "little")
-                name = self.manager.name.encode("utf-8").ljust(32, b"\0")
-                nonce = nacl.utils.random(32)
-                value_r = type_id + app_id + name + nonce + data["nonce"]
-                payload = hmac.new(self._shared_key, msg=value_r, digestmod=hashlib.sha256).digest()
+                app_id = self.manager.app_id_bytes
+                type_id = self.manager.type_id_bytes
+                name = self.manager.name_bytes
+                nonce = os.urandom(32)
+                h = self._hmac_template.copy()
+                h.update(type_id)
+                h.update(app_id)
+                h.update(name)
+                h.update(nonce)
+                h.update(data["nonce"])
+                payload = h.digest()
                 payload += type_id + app_id + name + nonce
                 self._challenge_command = NukiCommand.AUTH_DATA
                 cmd = self._prepare_command(NukiCommand.AUTH_DATA.value, payload)
                 await self._send_data(self._BLE_PAIRING_CHAR, cmd)
 
     async def _send_data(self, characteristic, data):
-        # Sometimes the connection to the smartlock fails, retry 3 times
-        for _ in range(self.retry):
-            try:
-                if not self._client or not self._client.is_connected:
-                    await self.connect()
-                if characteristic is None:
-                    characteristic = self._BLE_CHAR
-                logger.debug(f"Sending data to {characteristic}: {data}")
-                await self._client.write_gatt_char(characteristic, data)
-            except Exception as exc:
-                logger.exception(f"Error: {type(exc)} {exc}")
-                await asyncio.sleep(1)
+        # Sometimes the connection to the smartlock fails, retry with a short
+        # exponential backoff instead of a fixed 1s pause per attempt
+        async with self._send_lock:
+            for attempt in range(self.retry):
+                try:
+                    if not self._client or not self._client.is_connected:
+                        await self.connect()
+                    if characteristic is None:
+                        characteristic = self._BLE_CHAR
+                    logger.debug("Sending data to %s: %s", characteristic, data)
+                    await self._client.write_gatt_char(characteristic, data)
+                except Exception as exc:
+                    logger.exception("Error: %s %s", type(exc), exc)
+                    await asyncio.sleep(min(0.5, 0.05 * (2 ** attempt)))
+                else:
+                    # A successful write also pushes the idle disconnect back,
+                    # keeping the connection warm across command bursts
+                    self._reset_cmd_timeout()
+                    break
             else:
-                break
-        else:
-            await self.disconnect()
+                await self.disconnect()
 
     async def _safe_start_notify(self, *args):
         try:
@@ -563,24 +673,42 @@ class Nuki:
         except EOFError:
             logger.info("EOFError during notification")
 
+    def _reset_cmd_timeout(self):
+        if self._command_timeout_task:
+            self._command_timeout_task.cancel()
+        self._command_timeout_task = asyncio.create_task(self._start_cmd_timeout())
+
     async def connect(self):
+        if self._client and self._client.is_connected and self._notify_started:
+            # The link and its GATT subscriptions are still live; just push
+            # the idle disconnect back instead of re-running discovery
+            self._reset_cmd_timeout()
+            return
         if not self._client:
             self._client = self.manager.get_client(self.address, timeout=self.connection_timeout)
         await self.manager.stop_scanning()
         logger.info("Nuki connecting")
         await self._client.connect()
-        logger.debug(f"Services {[str(s) for s in self._client.services]}")
-        logger.debug(f"Characteristics {[str(v) for v in self._client.services.characteristics.values()]}")
+        if logger.isEnabledFor(logging.DEBUG):
+            # Building these lists is pure formatting work, skip it outright
+            # unless debug logging is on
+            logger.debug("Services %s", [str(s) for s in self._client.services])
+            logger.debug("Characteristics %s",
+                         [str(v) for v in self._client.services.characteristics.values()])
         if not self.device_type:
             services = await self._client.get_services()
             if services.get_characteristic(BLE_OPENER_PAIRING_CHAR):
                 self.device_type = DeviceType.OPENER
             else:
                 self.device_type = DeviceType.SMARTLOCK_1_2
-        await self._safe_start_notify(self._BLE_PAIRING_CHAR, self._notification_handler)
-        await self._safe_start_notify(self._BLE_CHAR, self._notification_handler)
+        if not self._notify_started:
+            # The two GATT subscriptions are independent, run them concurrently.
+            # They survive for the lifetime of the client, so only subscribe once
+            await asyncio.gather(self._safe_start_notify(self._BLE_PAIRING_CHAR, self._notification_handler),
+                                 self._safe_start_notify(self._BLE_CHAR, self._notification_handler))
+            self._notify_started = True
         logger.info("Connected")
-        self._command_timeout_task = asyncio.create_task(self._start_cmd_timeout())
+        self._reset_cmd_timeout()
 
     async def _start_cmd_timeout(self):
         await asyncio.sleep(self.command_timeout)
@@ -590,6 +718,7 @@ class Nuki:
     async def disconnect(self):
         logger.info("Nuki disconnecting")
         await self._client.disconnect()
+        self._notify_started = False
         if self._command_timeout_task:
             self._command_timeout_task.cancel()
             self._command_timeout_task = None
@@ -598,41 +727,41 @@ class Nuki:
     async def update_state(self):
         logger.info("Updating nuki state")
         self._challenge_command = NukiCommand.KEYTURNER_STATES
-        payload = NukiCommand.KEYTURNER_STATES.value.to_bytes(2, "little")
+        payload = _KEYTURNER_STATES_PAYLOAD
         cmd = self._encrypt_command(NukiCommand.REQUEST_DATA.value, payload)
         await self._send_data(self._BLE_CHAR, cmd)
 
     async def lock(self):
         logger.info("Locking nuki")
         self._challenge_command = NukiAction.LOCK
-        payload = NukiCommand.CHALLENGE.value.to_bytes(2, "little")
+        payload = _CHALLENGE_PAYLOAD
         cmd = self._encrypt_command(NukiCommand.REQUEST_DATA.value, payload)
         await self._send_data(self._BLE_CHAR, cmd)
 
     async def unlock(self):
         logger.info("Unlocking")
         self._challenge_command = NukiAction.UNLOCK
-        payload = NukiCommand.CHALLENGE.value.to_bytes(2, "little")
+        payload = _CHALLENGE_PAYLOAD
         cmd = self._encrypt_command(NukiCommand.REQUEST_DATA.value, payload)
         await self._send_data(self._BLE_CHAR, cmd)
 
     async def unlatch(self):
         self._challenge_command = NukiAction.UNLATCH
-        payload = NukiCommand.CHALLENGE.value.to_bytes(2, "little")
+        payload = _CHALLENGE_PAYLOAD
         cmd = self._encrypt_command(NukiCommand.REQUEST_DATA.value, payload)
         await self._send_data(self._BLE_CHAR, cmd)
 
     async def lock_action(self, action):
-        logger.info(f"Lock action {action}")
+        logger.info("Lock action %s", action)
         self._challenge_command = NukiAction(action)
-        payload = NukiCommand.CHALLENGE.value.to_bytes(2, "little")
+        payload = _CHALLENGE_PAYLOAD
         cmd = self._encrypt_command(NukiCommand.REQUEST_DATA.value, payload)
         await self._send_data(self._BLE_CHAR, cmd)
 
     async def get_config(self):
         logger.info("Retrieve nuki configuration")
         self._challenge_command = NukiCommand.REQUEST_CONFIG
-        payload = NukiCommand.CHALLENGE.value.to_bytes(2, "little")
+        payload = _CHALLENGE_PAYLOAD
         cmd = self._encrypt_command(NukiCommand.REQUEST_DATA.value, payload)
         await self._send_data(self._BLE_CHAR, cmd)
 